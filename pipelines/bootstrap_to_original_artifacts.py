@@ -2,9 +2,17 @@
 Bootstrap new bios (from refresh_step_1 outputs) into the SAME files
 your notebooks already read:
 
-1) data/processed/tmp_normalized/normalized_chunk_YYYYMMDD.csv
+1) data/processed/tmp_normalized/normalized_chunk_YYYY-MM-DD.csv
    - columns compatible with your existing normalized chunks:
-     ['qid','gender','country','occupation']  (strings)
+     ['qid','title','gender','country','occupation','deleted']  (strings;
+     title is the Wikidata English label from entities.csv)
+   - ONLY entities that are new or whose normalised attributes changed
+     since the last run, plus tombstones (deleted=1) for QIDs that have
+     disappeared from entities.csv. Readers replay chunks in sorted order,
+     keep the latest non-empty value per qid and column and drop tombstones.
+   - If today's chunk already exists with a different header (e.g. from an
+     older version of this script), the rows go to a suffixed file
+     (normalized_chunk_YYYY-MM-DD_02.csv) that sorts after it.
 
 2) data/raw/seed_enwiki_YYYYMMDD.csv
    - columns: ['qid','first_edit_ts']  (ISO8601)
@@ -15,9 +23,19 @@ Notes:
 - We keep rows with a qid; rows without qid are skipped.
 - Pages without a first revision timestamp are skipped in the seed file
   (they'll be picked up in a later refresh when timestamps appear).
+- data/cache/entity_hashes.csv keeps, per qid, a hash of the raw P21/P27/P106
+  values and of the normalised attributes. Only rows whose raw hash changed
+  are re-parsed and re-labelled; only rows whose normalised hash changed
+  are written.
+
+Usage:
+    python bootstrap_to_original_artifacts.py            # emit changes
+    python bootstrap_to_original_artifacts.py --compact  # merge all chunks
 """
 
 from pathlib import Path
+import os
+import sys
 import pandas as pd
 import requests
 import time
@@ -35,6 +53,8 @@ TMP_NORM_DIR  = PROC_DIR / "tmp_normalized"
 CACHE_DIR     = DATA / "cache"
 ENTITIES_CSV  = DATA / "entities" / "entities.csv"
 CREATIONS_CSV = DATA / "events"   / "creations.csv"
+HASH_INDEX    = CACHE_DIR / "entity_hashes.csv"
+COMPACTED_CSV = TMP_NORM_DIR / "normalized_chunk_0000_compacted.csv"  # sorts first
 
 RAW_DIR.mkdir(parents=True, exist_ok=True)
 TMP_NORM_DIR.mkdir(parents=True, exist_ok=True)
@@ -45,6 +65,9 @@ WD_API = "https://www.wikidata.org/w/api.php"
 HEADERS = {"User-Agent": "WikiGapsBootstrap/1.0 (ashhik96@gmail.com)"}
 BATCH = 50
 SLEEP = 0.1
+ATTR_COLS = ["P21", "P27", "P106"]
+NORM_COLS = ["gender", "country", "occupation"]
+CHUNK_COLS = ["qid", "title"] + NORM_COLS + ["deleted"]
 
 # ---------- Helpers ----------
 def batched(seq, n=BATCH):
@@ -100,6 +123,83 @@ def get_or_build_id_label_cache(unique_ids):
 
     return cache  # up-to-date cache
 
+def row_hash(df):
+    """Stable per-row content hash (as a string, so NaN-safe when mapped)."""
+    return pd.util.hash_pandas_object(df, index=False).astype(str).values
+
+def read_normalized_chunks(files):
+    """
+    Replay normalized chunks in order: per qid, each column takes its latest
+    non-empty value (chunks from different writers have different columns,
+    e.g. notebook 02 has titles the refresh may lack), and qids whose latest
+    row is a tombstone (deleted == 1) are dropped.
+    """
+    if not files:
+        return pd.DataFrame(columns=["qid"] + NORM_COLS)
+    df = pd.concat([pd.read_csv(f, dtype=str) for f in files], ignore_index=True)
+    latest = df.groupby("qid", sort=False).last()
+    if "deleted" in df.columns:
+        # A tombstone followed by a re-added qid must not stay deleted.
+        deleted = df.drop_duplicates(subset="qid", keep="last").set_index("qid")["deleted"]
+        latest = latest[deleted.reindex(latest.index) != "1"].drop(columns="deleted")
+    return latest.reset_index()
+
+def chunk_path_for(stamp, columns):
+    """
+    Today's chunk to append to: the first of normalized_chunk_<stamp>.csv,
+    normalized_chunk_<stamp>_02.csv, ... that is new or has the same header.
+    """
+    path = TMP_NORM_DIR / f"normalized_chunk_{stamp}.csv"
+    n = 1
+    while path.exists() and list(pd.read_csv(path, nrows=0).columns) != list(columns):
+        n += 1
+        path = TMP_NORM_DIR / f"normalized_chunk_{stamp}_{n:02d}.csv"
+    return path
+
+def load_hash_index(ent_qids):
+    """
+    Return the per-qid hash index (indexed by qid; columns raw_hash, norm_hash).
+    On the first run the normalised hashes are seeded from the chunks already
+    on disk, so entities a previous full-copy run wrote are not emitted again.
+    """
+    if HASH_INDEX.exists():
+        return pd.read_csv(HASH_INDEX, dtype=str).set_index("qid")
+
+    prev = read_normalized_chunks(sorted(TMP_NORM_DIR.glob("normalized_chunk_*.csv")))
+    prev = prev[prev["qid"].isin(ent_qids)]
+    index = pd.DataFrame({
+        "qid": prev["qid"].values,
+        "raw_hash": "",
+        "norm_hash": row_hash(prev[NORM_COLS]) if not prev.empty else [],
+    })
+    return index.set_index("qid")
+
+def compact_chunks():
+    """
+    Merge every normalized chunk into COMPACTED_CSV (one row per live qid).
+    The compacted file is written first and sorts first, and the merged
+    chunks are removed oldest-first, so an interrupted compaction still
+    replays to the same result.
+    """
+    files = sorted(TMP_NORM_DIR.glob("normalized_chunk_*.csv"))
+    if len(files) < 2:
+        print("Nothing to compact.")
+        return
+    print(f"🗜️  Compacting {len(files)} normalized chunks...")
+    merged = read_normalized_chunks(files)
+    tmp = COMPACTED_CSV.with_suffix(".tmp")
+    merged.to_csv(tmp, index=False)
+    os.replace(tmp, COMPACTED_CSV)
+    merged_files = [f for f in files if f != COMPACTED_CSV]
+    for f in merged_files:
+        f.unlink()
+    print(f"💾 Wrote {COMPACTED_CSV}")
+    print(f"   Rows: {len(merged):,} (removed {len(merged_files)} chunk files)")
+
+if "--compact" in sys.argv:
+    compact_chunks()
+    sys.exit(0)
+
 # ---------- Load incremental outputs (from refresh_step_1) ----------
 if not ENTITIES_CSV.exists():
     raise SystemExit("❌ data/entities/entities.csv not found. Run refresh_step_1.py first.")
@@ -120,6 +220,21 @@ else:
 ent_min = ent[["pageid","qid"]].dropna().drop_duplicates()
 seed = cre.merge(ent_min, on="pageid", how="inner")[["qid","first_rev_ts"]].dropna().drop_duplicates()
 
+# ---------- Change detection ----------
+# entities.csv is upserted by pageid, so one qid can appear more than once;
+# the last row is the most recent.
+for col in ATTR_COLS:
+    if col not in ent.columns:
+        ent[col] = None
+ent = ent.dropna(subset=["qid"]).drop_duplicates(subset="qid", keep="last").copy()
+ent["raw_hash"] = row_hash(ent[ATTR_COLS])
+
+index = load_hash_index(set(ent["qid"]))
+touched = ent[ent["raw_hash"] != ent["qid"].map(index["raw_hash"])].copy()
+retracted = index.index.difference(ent["qid"])
+print(f"🔍 {len(touched):,} of {len(ent):,} entities new or with changed properties; "
+      f"{len(retracted):,} retracted")
+
 # ---------- Expand / normalize P21,P27,P106 (ID lists) ----------
 # Ensure list-like strings -> python lists (safe eval)
 def to_list_safe(x):
@@ -136,14 +251,14 @@ def to_list_safe(x):
     return [x]
 
 print("🔄 Parsing property lists...")
-ent["P21_list"]  = ent["P21"].apply(to_list_safe)   if "P21" in ent.columns else [[]]*len(ent)
-ent["P27_list"]  = ent["P27"].apply(to_list_safe)   if "P27" in ent.columns else [[]]*len(ent)
-ent["P106_list"] = ent["P106"].apply(to_list_safe)  if "P106" in ent.columns else [[]]*len(ent)
+touched["P21_list"]  = touched["P21"].apply(to_list_safe)
+touched["P27_list"]  = touched["P27"].apply(to_list_safe)
+touched["P106_list"] = touched["P106"].apply(to_list_safe)
 
 # Collect all unique IDs to label
 all_ids = set()
 for col in ["P21_list","P27_list","P106_list"]:
-    for lst in ent[col]:
+    for lst in touched[col]:
         all_ids.update(lst)
 all_ids = {i for i in all_ids if i}
 
@@ -162,12 +277,14 @@ def first_label(lst):
 
 # Map to strings your notebooks expect
 print("🔀 Normalizing to notebook format...")
-ent["gender"]     = ent["P21_list"].apply(first_label).str.lower()
-ent["country"]    = ent["P27_list"].apply(first_label)
-ent["occupation"] = ent["P106_list"].apply(first_label)
+touched["gender"]     = touched["P21_list"].apply(first_label).str.lower()
+touched["country"]    = touched["P27_list"].apply(first_label)
+touched["occupation"] = touched["P106_list"].apply(first_label)
 
-# Keep qid and these 3 columns for the normalized chunk
-norm = ent[["qid","gender","country","occupation"]].dropna(subset=["qid"]).copy()
+# Keep qid, title and these 3 columns for the normalized chunk
+if "label_en" not in touched.columns:
+    touched["label_en"] = None
+norm = touched[["qid","label_en","gender","country","occupation"]].rename(columns={"label_en": "title"})
 norm["qid"] = norm["qid"].astype(str)
 
 # Basic cleanup to align with your notebooks
@@ -176,15 +293,37 @@ norm["gender"] = norm["gender"].str.strip().str.lower().fillna("unknown")
 norm["country"] = norm["country"].fillna("unknown")
 norm["occupation"] = norm["occupation"].fillna("unknown")
 
+# Only emit rows whose normalised attributes actually changed (a new
+# occupation ID that maps to the same label is not a change).
+norm["norm_hash"] = row_hash(norm[NORM_COLS])
+changed = norm[norm["norm_hash"] != norm["qid"].map(index["norm_hash"])]
+tombstones = pd.DataFrame({"qid": retracted, "gender": "unknown",
+                           "country": "unknown", "occupation": "unknown", "deleted": 1})
+delta = pd.concat([changed[["qid","title"] + NORM_COLS], tombstones], ignore_index=True)
+delta["deleted"] = delta["deleted"].astype("Int64")  # 1 for tombstones, blank otherwise
+delta = delta[CHUNK_COLS]
+
 # ---------- Write the two artifacts your notebooks use ----------
 stamp = datetime.now(timezone.utc).strftime("%Y-%m-%d")
 
 # 1) normalized chunk - MATCHES notebook 02 pattern: "normalized_chunk_*.csv"
-chunk_path = TMP_NORM_DIR / f"normalized_chunk_{stamp}.csv"
-norm.to_csv(chunk_path, index=False)
-print(f"💾 Wrote normalized chunk: {chunk_path}")
-print(f"   Columns: {list(norm.columns)}")
-print(f"   Rows: {len(norm):,}")
+#    A second run on the same day appends to that day's chunk, unless its
+#    header differs (then a suffixed chunk is started).
+chunk_path = chunk_path_for(stamp, delta.columns)
+if delta.empty:
+    print("✅ No new or changed entities - no normalized chunk written")
+else:
+    delta.to_csv(chunk_path, mode="a", header=not chunk_path.exists(), index=False)
+    print(f"💾 Wrote normalized chunk: {chunk_path}")
+    print(f"   Columns: {list(delta.columns)}")
+    print(f"   Rows: {len(changed):,} new/changed, {len(tombstones):,} tombstones")
+
+# Update the hash index only after the chunk is on disk, so an interrupted
+# run re-emits rather than loses changes.
+new_index = ent[["qid","raw_hash"]].set_index("qid")
+new_index["norm_hash"] = index["norm_hash"].reindex(new_index.index)
+new_index.loc[norm["qid"], "norm_hash"] = norm["norm_hash"].values
+new_index.reset_index().to_csv(HASH_INDEX, index=False)
 
 # 2) seed file (qid, first_edit_ts)
 #    Note: 03/04 call the column 'first_edit_ts', so we rename here.
@@ -211,3 +350,4 @@ print("3. Re-run notebook 07 (intersectional_analysis.ipynb)")
 print("4. Re-run notebook 04 (visualization.ipynb)")
 print("5. Re-run notebook 05 (dashboard.ipynb)")
 print("\nYour dashboard will now include the refreshed data!")
+print("Run with --compact occasionally to merge old normalized chunks.")
@@ -0,0 +1,319 @@
+"""
+Breadth-first category crawler for the initial seed.
+
+Expands every seed category in conf/project.json into its member pages,
+following subcategories (namespace 14) down to `recurse_depth` levels
+(0 = direct members only, which is what notebook 01 did originally).
+
+Output:
+    data/raw/category_pages.csv
+      - columns: ['pageid','title','seed_category','depth']
+      - rows are streamed as each API page comes back, so memory stays flat
+        even for multi-million-member trees.
+
+Notes:
+- Each level of the tree is drained completely before the next one starts,
+  so every category is expanded at its shallowest depth. Up to `api_workers`
+  categorymembers requests run concurrently within a level.
+- Seen pages and seen categories are tracked as pageid bitmaps (one bit per
+  pageid, ~10 MB for all of enwiki) instead of DataFrame drop_duplicates.
+  A subcategory that was already expanded is a cycle (or a diamond) and is
+  counted but not walked again.
+- Progress is checkpointed to data/cache/crawl_checkpoint.pkl every
+  CKPT_EVERY requests, including the cmcontinue token of every category that
+  is still in flight. Re-running resumes from the last checkpoint; rows
+  written after it are truncated from the CSV first.
+- A finished crawl is reused as long as seed_categories, recurse_depth and
+  language are unchanged. If they differ from the checkpoint, the crawl
+  stops and asks for --restart instead of mixing two walks.
+
+Usage:
+    python pipelines/category_crawler.py            # start or resume
+    python pipelines/category_crawler.py --restart  # discard checkpoint
+"""
+
+import csv
+import json
+import os
+import pickle
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+import requests
+
+# ---------- Paths ----------
+ROOT = Path.cwd()
+if ROOT.name in ("notebooks", "pipelines"):
+    ROOT = ROOT.parent
+
+CONF_PATH  = ROOT / "conf" / "project.json"
+DATA       = ROOT / "data"
+RAW_DIR    = DATA / "raw"
+CACHE_DIR  = DATA / "cache"
+PAGES_CSV  = RAW_DIR / "category_pages.csv"
+CKPT_PATH  = CACHE_DIR / "crawl_checkpoint.pkl"
+
+# ---------- Config ----------
+HEADERS = {"User-Agent": "WikiGaps/0.1 (contact: ashhik96@gmail.com)"}
+PAGE_COLUMNS = ["pageid", "title", "seed_category", "depth"]
+CKPT_EVERY = 200   # requests between checkpoints
+LOG_EVERY = 50     # requests between progress lines
+RETRIES = 5
+CRAWL_KEYS = ("seed_categories", "recurse_depth", "language")  # must match to resume
+
+# ---------- Helpers ----------
+class PageidBitmap:
+    """Growable set of non-negative ints stored as one bit per value."""
+
+    def __init__(self, data=b"", count=0):
+        self.bits = bytearray(data)
+        self.count = count
+
+    def add(self, n):
+        """Add n; return True if it was not already present."""
+        byte, mask = n >> 3, 1 << (n & 7)
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(max(byte + 1 - len(self.bits), len(self.bits))))
+        if self.bits[byte] & mask:
+            return False
+        self.bits[byte] |= mask
+        self.count += 1
+        return True
+
+    def __contains__(self, n):
+        byte = n >> 3
+        return byte < len(self.bits) and bool(self.bits[byte] & (1 << (n & 7)))
+
+    def __len__(self):
+        return self.count
+
+def mw_get(api, params, maxlag):
+    """GET with maxlag/backoff retries; raises after RETRIES failures."""
+    p = dict(params, format="json", formatversion=2, maxlag=maxlag)
+    for i in range(RETRIES):
+        try:
+            r = requests.get(api, params=p, headers=HEADERS, timeout=60)
+            if r.status_code in (429, 503):
+                time.sleep(1.5 * (i + 1)); continue
+            r.raise_for_status()
+            js = r.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"⚠️  Request failed ({e}); retrying")
+            time.sleep(1.5 * (i + 1)); continue
+        if "error" in js:
+            if js["error"].get("code") == "maxlag":
+                time.sleep(int(js["error"].get("lag", maxlag))); continue
+            raise RuntimeError(f"API error: {js['error']}")
+        return js
+    raise RuntimeError(f"Failed after {RETRIES} retries: {params}")
+
+def resolve_category_ids(api, titles, maxlag):
+    """
+    Return {title: pageid} for the existing categories among titles, keyed by
+    the titles as given. The API answers with normalised titles
+    ("Category:Living_people" -> "Category:Living people", first letter
+    upper-cased), so those are mapped back through query.normalized.
+    """
+    out = {}
+    for i in range(0, len(titles), 50):
+        batch = titles[i:i + 50]
+        js = mw_get(api, {"action": "query", "prop": "info",
+                          "titles": "|".join(batch)}, maxlag)
+        query = js.get("query", {})
+        canonical = {n["from"]: n["to"] for n in query.get("normalized", [])}
+        ids = {page["title"]: int(page["pageid"]) for page in query.get("pages", [])
+               if not page.get("missing") and page.get("pageid")}
+        for title in batch:
+            pageid = ids.get(canonical.get(title, title))
+            if pageid:
+                out[title] = pageid
+    return out
+
+def fetch_members_page(api, title, cont, maxlag, sleep):
+    """One categorymembers call: (members, next cmcontinue or None)."""
+    params = {
+        "action": "query", "list": "categorymembers", "cmtitle": title,
+        "cmnamespace": "0|14", "cmprop": "ids|title|ns", "cmlimit": "max",
+    }
+    if cont:
+        params["cmcontinue"] = cont
+    js = mw_get(api, params, maxlag)
+    time.sleep(sleep)
+    members = js.get("query", {}).get("categorymembers", [])
+    return members, js.get("continue", {}).get("cmcontinue")
+
+def save_state(state):
+    """Atomically replace the checkpoint file (bitmaps stored as raw bytes)."""
+    out = dict(state)
+    for key in ("seen_pages", "seen_cats"):
+        out[key] = (bytes(state[key].bits), state[key].count)
+    tmp = CKPT_PATH.with_suffix(".tmp")
+    with open(tmp, "wb") as f:
+        pickle.dump(out, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, CKPT_PATH)
+
+def load_state():
+    if not CKPT_PATH.exists():
+        return None
+    with open(CKPT_PATH, "rb") as f:
+        state = pickle.load(f)
+    for key in ("seen_pages", "seen_cats"):
+        state[key] = PageidBitmap(*state[key])
+    return state
+
+def crawl_config(conf):
+    """The settings that define a crawl; a checkpoint is only valid for these."""
+    return {key: conf.get(key) for key in CRAWL_KEYS}
+
+def new_state(api, conf):
+    seeds = conf["seed_categories"]
+    ids = resolve_category_ids(api, seeds, conf["api_maxlag"])
+    seen_cats = PageidBitmap()
+    frontier = []
+    for title in seeds:
+        if title not in ids:
+            print(f"⚠️  Seed category not found, skipping: {title}")
+            continue
+        if seen_cats.add(ids[title]):
+            frontier.append({"title": title, "seed": title, "cont": None})
+    return {
+        "config": crawl_config(conf),
+        "depth": 0,
+        "frontier": frontier,        # categories (or their continuations) at `depth`
+        "next_frontier": [],         # subcategories discovered for depth + 1
+        "seen_pages": PageidBitmap(),
+        "seen_cats": seen_cats,
+        "out_bytes": 0,              # CSV size at the time of this checkpoint
+        "stats": {"requests": 0, "pages": 0, "categories": len(frontier), "cycles": 0},
+        "done": False,
+    }
+
+# ---------- Crawl ----------
+def crawl(conf, restart=False):
+    """
+    Walk conf['seed_categories'] down to conf['recurse_depth'] and stream the
+    member pages to data/raw/category_pages.csv. Returns the CSV path.
+    """
+    RAW_DIR.mkdir(parents=True, exist_ok=True)
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+    api = f"https://{conf['language']}.wikipedia.org/w/api.php"
+    max_depth = int(conf.get("recurse_depth", 0))
+    workers = int(conf.get("api_workers", 4))
+    maxlag, sleep = conf["api_maxlag"], conf["api_sleep"]
+
+    state = None if restart else load_state()
+    if state and state.get("config") != crawl_config(conf):
+        raise SystemExit(
+            f"❌ {CKPT_PATH} was built with {state.get('config')}, but the current "
+            f"config is {crawl_config(conf)}. Re-run with --restart "
+            "(crawl(CONF, restart=True) in notebook 01) to crawl again.")
+    if state and state["done"]:
+        print(f"✅ Crawl already complete: {state['stats']['pages']:,} pages in {PAGES_CSV}")
+        return PAGES_CSV
+    if state:
+        print(f"▶️ Resuming at depth {state['depth']} with {len(state['frontier']):,} "
+              f"categories queued ({state['stats']['pages']:,} pages so far)")
+    else:
+        state = new_state(api, conf)
+        print(f"🌱 Starting crawl of {len(state['frontier'])} seed categor(y/ies), "
+              f"recurse_depth={max_depth}, workers={workers}")
+
+    stats = state["stats"]
+    seen_pages, seen_cats = state["seen_pages"], state["seen_cats"]
+    frontier = deque(state["frontier"])
+    inflight = {}
+
+    if state["out_bytes"] and not PAGES_CSV.exists():
+        raise SystemExit(f"❌ {PAGES_CSV} is missing but the checkpoint expects it. "
+                         "Re-run with --restart.")
+
+    # Drop any rows written after the last checkpoint; they will be re-fetched.
+    mode = "r+" if PAGES_CSV.exists() and state["out_bytes"] else "w"
+    with open(PAGES_CSV, mode, newline="", encoding="utf-8") as fh, \
+         ThreadPoolExecutor(max_workers=workers) as pool:
+        fh.seek(state["out_bytes"])
+        fh.truncate()
+        writer = csv.writer(fh)
+        if state["out_bytes"] == 0:
+            writer.writerow(PAGE_COLUMNS)
+
+        def checkpoint(done=False):
+            fh.flush()
+            state["frontier"] = list(frontier) + list(inflight.values())
+            state["out_bytes"] = fh.tell()
+            state["done"] = done
+            save_state(state)
+
+        try:
+            while True:
+                if not frontier and not inflight:
+                    if not state["next_frontier"]:
+                        break
+                    state["depth"] += 1
+                    frontier.extend(state["next_frontier"])
+                    state["next_frontier"] = []
+                    print(f"⬇️  Depth {state['depth']}: {len(frontier):,} categories")
+
+                while frontier and len(inflight) < workers:
+                    item = frontier.popleft()
+                    fut = pool.submit(fetch_members_page, api, item["title"],
+                                      item["cont"], maxlag, sleep)
+                    inflight[fut] = item
+
+                done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    members, cont = fut.result()
+                    item = inflight[fut]
+
+                    for m in members:
+                        pid = m.get("pageid")
+                        if not pid:
+                            continue
+                        if m.get("ns") == 0:
+                            if seen_pages.add(pid):
+                                writer.writerow([pid, m.get("title"), item["seed"], state["depth"]])
+                                stats["pages"] += 1
+                        elif m.get("ns") == 14 and state["depth"] < max_depth:
+                            if seen_cats.add(pid):
+                                state["next_frontier"].append(
+                                    {"title": m["title"], "seed": item["seed"], "cont": None})
+                                stats["categories"] += 1
+                            else:
+                                stats["cycles"] += 1
+
+                    if cont:
+                        frontier.append(dict(item, cont=cont))
+                    # Only now is the request fully accounted for; an interrupt
+                    # above leaves it in `inflight` so the checkpoint re-queues it.
+                    del inflight[fut]
+                    stats["requests"] += 1
+
+                    if stats["requests"] % LOG_EVERY == 0:
+                        print(f"   {stats['requests']:,} requests | {stats['pages']:,} pages | "
+                              f"{stats['categories']:,} categories | "
+                              f"{len(frontier) + len(inflight):,} queued")
+                    if stats["requests"] % CKPT_EVERY == 0:
+                        checkpoint()
+        except BaseException:
+            # Unprocessed results are discarded; their request parameters are
+            # still in `inflight` and get re-queued with the frontier.
+            checkpoint()
+            print(f"💾 Checkpoint saved to {CKPT_PATH}; re-run to resume.")
+            raise
+
+        checkpoint(done=True)
+
+    print(f"\n✅ Crawl complete: {stats['pages']:,} unique pages from "
+          f"{stats['categories']:,} categories ({stats['cycles']:,} repeat/cyclic "
+          f"subcategory links skipped)")
+    print(f"💾 Wrote {PAGES_CSV}")
+    return PAGES_CSV
+
+if __name__ == "__main__":
+    with open(CONF_PATH) as f:
+        CONF = json.load(f)
+    crawl(CONF, restart="--restart" in sys.argv)
@@ -0,0 +1,418 @@
+"""
+Breakpoint scan for the interrupted time series (ITS) analysis.
+
+Notebook 05 fits one segmented regression of the female share with the
+breakpoints fixed at 2017 and 2020. This module fits the same model for
+every candidate breakpoint pair (t1, t2) and every (gender, continent,
+occupation_group) series in data/processed/yearly_aggregates.csv:
+
+    share_t = b0 + trend*t
+                 + level_1*D1 + slope_1*(t - t1)*D1
+                 + level_2*D2 + slope_2*(t - t2)*D2
+
+share_t is the gender's percentage of the biographies created in year t
+within that continent/occupation cell ("All" pools over that dimension),
+and D1/D2 switch on from t1/t2.
+
+Notes:
+- For one breakpoint pair the design matrix is the same for every series,
+  so all series are fitted with one matrix product. Resampling adds a
+  replicate axis to that product instead of looping in Python.
+- Breakpoint pairs are spread across a process pool.
+- Resampling (`method`):
+    "block"       moving-block bootstrap of the leverage-adjusted, centred
+                  residuals e/sqrt(1-h); raw OLS residuals understate the
+                  error variance with only ~11 years and 6 parameters.
+                  Intervals and p-values are studentized (bootstrap-t):
+                  with ~5 residual degrees of freedom, percentile
+                  intervals are far too narrow. `block_length` defaults
+                  to 1: on 11-year series longer blocks over-reject, so
+                  only raise it for much longer series.
+    "permutation" Freedman-Lane: permute the residuals of the no-break
+                  model (intercept + trend) and refit. Compared on the
+                  t statistic, like the block method. The trend is part of
+                  the no-break model, so it gets no permutation p-value.
+  The residual positions for a breakpoint pair are drawn once and shared
+  by every series, so results do not depend on `batch_size`.
+- Each segment gets at least `min_segment` (default 3) years; a 2-year
+  segment would be fitted exactly by its own level and slope. On 2015-2025
+  that leaves 6 pairs and excludes 2017/2020; fit_fixed() fits such a pair
+  with classic p-values only.
+- The per-pair p-values and intervals hold for a pair chosen in advance.
+  After picking the lowest-AIC pair, use `scan_p` instead: it repeats the
+  search over all pairs in every permutation (best_breakpoints() renames
+  the per-pair columns to *_given_pair to make that explicit).
+- Series are only kept when every year has at least `min_cell`
+  biographies in the cell (the ethics.min_cell setting in project.json).
+- Countries are grouped with the continent_map in conf/project.json, the
+  same mapping notebook 05 uses.
+- Results are cached in data/processed/statistical_analysis/its_scan/,
+  keyed by a hash of the aggregate table and the scan settings, so
+  unchanged data is not re-fitted.
+
+Usage:
+    python pipelines/its_breakpoint_scan.py                  # block bootstrap
+    python pipelines/its_breakpoint_scan.py --permutation
+    python pipelines/its_breakpoint_scan.py --refresh        # ignore cache
+"""
+
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# ---------- Paths ----------
+ROOT = Path.cwd()
+if ROOT.name in ("notebooks", "pipelines"):
+    ROOT = ROOT.parent
+
+CONF_PATH  = ROOT / "conf" / "project.json"
+AGG_CSV    = ROOT / "data" / "processed" / "yearly_aggregates.csv"
+STATS_DIR  = ROOT / "data" / "processed" / "statistical_analysis"
+CACHE_DIR  = STATS_DIR / "its_scan"
+
+# ---------- Config ----------
+TERMS = ["trend", "level_1", "slope_1", "level_2", "slope_2"]
+SERIES_KEYS = ["gender", "continent", "occupation_group"]
+AGG_COLUMNS = ["creation_year", "gender", "country", "occupation_group", "count"]
+SCAN_VERSION = 4   # bump when fitting/resampling changes so old caches are ignored
+
+# ---------- Series preparation ----------
+def build_series(agg, continent_map=None, min_cell=20, start_year=None):
+    """
+    Turn the yearly aggregates into a share matrix.
+
+    Returns (keys, years, Y): keys is a DataFrame of SERIES_KEYS with one row
+    per series, years the consecutive years covered and Y the
+    (n_series, n_years) matrix of percentage shares.
+    """
+    df = agg[AGG_COLUMNS].copy()
+    if start_year is not None:
+        df = df[df["creation_year"] >= start_year]
+    df["continent"] = df["country"].map(continent_map or {})
+
+    # One long table with "All" margins for continent and occupation.
+    # Countries without a continent only contribute to the "All" rows.
+    levels = ["continent", "occupation_group", "creation_year", "gender"]
+    parts = [df.groupby(levels)["count"].sum().reset_index()]
+    for pooled in (["continent"], ["occupation_group"], ["continent", "occupation_group"]):
+        keep = [c for c in levels if c not in pooled]
+        part = df.groupby(keep)["count"].sum().reset_index()
+        for col in pooled:
+            part[col] = "All"
+        parts.append(part)
+    long = pd.concat(parts, ignore_index=True)
+
+    years = np.arange(df["creation_year"].min(), df["creation_year"].max() + 1)
+    counts = long.pivot_table(index=SERIES_KEYS, columns="creation_year",
+                              values="count", aggfunc="sum", fill_value=0)
+    counts = counts.reindex(columns=years, fill_value=0)
+    totals = counts.groupby(level=["continent", "occupation_group"]).transform("sum")
+
+    keep = (totals >= min_cell).all(axis=1) & (counts.sum(axis=1) > 0)
+    counts, totals = counts[keep], totals[keep]
+    Y = 100 * counts.to_numpy(dtype=float) / totals.to_numpy(dtype=float)
+    keys = counts.index.to_frame(index=False)
+    return keys, years, Y
+
+def candidate_pairs(years, min_segment=3):
+    """All (t1, t2) leaving at least `min_segment` years in each of the three segments."""
+    first, last = years[0], years[-1]
+    return [(int(t1), int(t2))
+            for t1 in years for t2 in years
+            if t1 - first >= min_segment and t2 - t1 >= min_segment
+            and last - t2 + 1 >= min_segment]
+
+def design_matrix(years, t1, t2):
+    t = (years - years[0]).astype(float)
+    d1 = (years >= t1).astype(float)
+    d2 = (years >= t2).astype(float)
+    return np.column_stack([np.ones_like(t), t, d1, (years - t1) * d1, d2, (years - t2) * d2])
+
+# ---------- Fitting (runs in worker processes) ----------
+_Y = None
+_YEARS = None
+_OPTS = None
+
+def _init_worker(Y, years, opts):
+    global _Y, _YEARS, _OPTS
+    _Y, _YEARS, _OPTS = Y, years, opts
+
+def _block_indices(rng, n, n_resamples, block_length):
+    """
+    (n_resamples, n) residual positions for a circular block bootstrap.
+    Blocks wrap around the end so every year is drawn equally often; plain
+    moving blocks under-sample the first and last years of a short series.
+    """
+    n_blocks = -(-n // block_length)
+    starts = rng.integers(0, n, size=(n_resamples, n_blocks))
+    idx = (starts[:, :, None] + np.arange(block_length)) % n
+    return idx.reshape(n_resamples, -1)[:, :n]
+
+def _ols(Y, X, P, xtx_inv):
+    """Classic OLS for every row of Y; returns (coef, se, fitted, resid, rss)."""
+    coef = Y @ P.T
+    fitted = coef @ X.T
+    resid = Y - fitted
+    rss = (resid ** 2).sum(axis=-1)
+    se = np.sqrt(rss[..., None] / (X.shape[0] - X.shape[1]) * np.diag(xtx_inv))
+    return coef, se, fitted, resid, rss
+
+def _resample(idx, Y, X, P, xtx_inv, coef, se, fitted, resid, opts):
+    """
+    Return (ci_low, ci_high, resample_p), each (n_series, k). `idx` holds the
+    (n_resamples, n) residual positions for every replicate.
+    """
+    alpha = 1 - opts["ci"]
+    q = [100 * alpha / 2, 100 * (1 - alpha / 2)]
+
+    if opts["method"] == "block":
+        h = np.diag(X @ P)
+        adj = resid / np.sqrt(1 - h)
+        adj -= adj.mean(axis=1, keepdims=True)
+        ystar = fitted[:, None, :] + adj[:, idx]          # (S, R, n)
+        ref = coef
+    else:
+        # Freedman-Lane: the reduced model's fit plus its permuted residuals.
+        # Under the null the break terms are 0 and the trend stays at the
+        # reduced model's estimate.
+        Xr = X[:, :2]
+        cr = Y @ np.linalg.pinv(Xr).T
+        fr = cr @ Xr.T
+        ystar = fr[:, None, :] + (Y - fr)[:, idx]
+        ref = np.zeros_like(coef)
+        ref[:, :2] = cr
+
+    cstar, sestar, _, _, _ = _ols(ystar, X, P, xtx_inv)  # (S, R, k)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tstar = (cstar - ref[:, None, :]) / sestar
+        tobs = coef / se
+    tlo, thi = np.percentile(tstar, q, axis=1)
+    p = (1 + (np.abs(tstar) >= np.abs(tobs)[:, None, :]).sum(axis=1)) / (opts["n_resamples"] + 1)
+    if opts["method"] == "permutation":
+        # Intercept and trend are in the reduced model, so the permutations
+        # say nothing about them being 0.
+        p[:, :2] = np.nan
+    return coef - thi * se, coef - tlo * se, p
+
+def fit_pair(pair, seed):
+    """Fit every series for one breakpoint pair; returns a dict of arrays."""
+    Y, years, opts = _Y, _YEARS, _OPTS
+    t1, t2 = pair
+    X = design_matrix(years, t1, t2)
+    n, k = X.shape
+    xtx_inv = np.linalg.inv(X.T @ X)
+    P = xtx_inv @ X.T
+
+    # Drawn once for the pair, so every series sees the same replicates and
+    # the results do not depend on batch_size.
+    rng = np.random.default_rng(seed)
+    if opts["method"] == "block":
+        idx = _block_indices(rng, n, opts["n_resamples"], opts["block_length"])
+    else:
+        idx = np.argsort(rng.random((opts["n_resamples"], n)), axis=1)
+
+    out = {name: np.empty((len(Y), k)) for name in
+           ("coef", "se", "p_value", "ci_low", "ci_high", "resample_p")}
+    out["rss"] = np.empty(len(Y))
+    out["r_squared"] = np.empty(len(Y))
+
+    for start in range(0, len(Y), opts["batch_size"]):
+        sl = slice(start, start + opts["batch_size"])
+        Yb = Y[sl]
+        coef, se, fitted, resid, rss = _ols(Yb, X, P, xtx_inv)
+        tss = ((Yb - Yb.mean(axis=1, keepdims=True)) ** 2).sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            tstat = coef / se
+            out["r_squared"][sl] = 1 - rss / tss
+        out["coef"][sl] = coef
+        out["se"][sl] = se
+        out["p_value"][sl] = 2 * stats.t.sf(np.abs(tstat), n - k)
+        out["rss"][sl] = rss
+        lo, hi, p = _resample(idx, Yb, X, P, xtx_inv, coef, se, fitted, resid, opts)
+        out["ci_low"][sl], out["ci_high"][sl], out["resample_p"][sl] = lo, hi, p
+
+    with np.errstate(divide="ignore"):
+        out["aic"] = n * np.log(out["rss"] / n) + 2 * k
+    return out
+
+# ---------- Selection-adjusted test ----------
+def scan_pvalue(Y, years, pairs, n_resamples=999, seed=0, batch_size=256):
+    """
+    Per-series p-value for "no breakpoints at all", allowing for the search
+    over `pairs`.
+
+    The statistic is the largest F for adding the four break terms to the
+    no-break model (intercept + trend) over all pairs; every pair has the
+    same number of parameters, so this is the lowest-AIC pair. Its null
+    distribution comes from permuting the no-break residuals and repeating
+    the whole search in every replicate.
+    """
+    n, k = len(years), 6
+    Q0 = np.linalg.qr(design_matrix(years, years[0], years[0])[:, :2])[0]
+    Q = np.stack([np.linalg.qr(design_matrix(years, t1, t2))[0] for t1, t2 in pairs])
+
+    def max_f(Y):
+        # After removing the no-break fit, each pair's RSS is what is left
+        # once its own basis is projected out too.
+        E = Y - (Y @ Q0) @ Q0.T
+        rss0 = (E ** 2).sum(axis=-1)
+        proj = np.einsum("...n,pnk->...pk", E, Q)
+        rss = rss0[..., None] - (proj ** 2).sum(axis=-1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            f = (rss0[..., None] - rss) / (k - 2) / (rss / (n - k))
+        return f.max(axis=-1)
+
+    rng = np.random.default_rng(seed)
+    idx = np.argsort(rng.random((n_resamples, n)), axis=1)
+    out = np.empty(len(Y))
+    for start in range(0, len(Y), batch_size):
+        Yb = Y[start:start + batch_size]
+        E = Yb - (Yb @ Q0) @ Q0.T
+        fobs = max_f(Yb)
+        fstar = max_f(E[:, idx])                           # (S, R)
+        out[start:start + batch_size] = (1 + (fstar >= fobs[:, None]).sum(axis=1)) / (n_resamples + 1)
+    return out
+
+def _long_frame(keys, t1, t2, fit, names):
+    """One row per (series, term) for one breakpoint pair; the intercept is dropped."""
+    S, T = len(keys), len(TERMS)
+    frame = keys.loc[keys.index.repeat(T)].reset_index(drop=True)
+    frame["break_1"], frame["break_2"] = t1, t2
+    frame["term"] = np.tile(TERMS, S)
+    for name in names:
+        frame[name] = fit[name][:, 1:].ravel()
+    for name in ("r_squared", "rss", "aic"):
+        frame[name] = np.repeat(fit[name], T)
+    return frame
+
+def fit_fixed(agg, t1, t2, continent_map=None, min_cell=20, start_year=None):
+    """
+    Fit one breakpoint pair (e.g. the hard-coded 2017/2020) for every series
+    with classic OLS p-values only. Use this for pairs the scan leaves out,
+    such as segments shorter than `min_segment`; the AIC is comparable with
+    the scan's, since the series and the number of parameters are the same.
+    """
+    keys, years, Y = build_series(agg, continent_map, min_cell, start_year)
+    X = design_matrix(years, t1, t2)
+    n, k = X.shape
+    xtx_inv = np.linalg.inv(X.T @ X)
+    coef, se, _, _, rss = _ols(Y, X, xtx_inv @ X.T, xtx_inv)
+    tss = ((Y - Y.mean(axis=1, keepdims=True)) ** 2).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fit = dict(coef=coef, se=se, p_value=2 * stats.t.sf(np.abs(coef / se), n - k),
+                   rss=rss, r_squared=1 - rss / tss, aic=n * np.log(rss / n) + 2 * k)
+    frame = _long_frame(keys, t1, t2, fit, ("coef", "se", "p_value"))
+    frame["n_years"] = n
+    return frame
+
+# ---------- Cache ----------
+def table_hash(agg, settings):
+    """Hash of the aggregate table contents (row order ignored) plus settings."""
+    t = agg[AGG_COLUMNS].sort_values(AGG_COLUMNS).reset_index(drop=True)
+    h = hashlib.sha256(pd.util.hash_pandas_object(t, index=False).to_numpy().tobytes())
+    h.update(json.dumps(settings, sort_keys=True, default=str).encode())
+    return h.hexdigest()[:16]
+
+# ---------- Scan ----------
+def scan(agg, continent_map=None, method="block", n_resamples=999, block_length=1,
+         ci=0.95, min_cell=20, min_segment=3, start_year=None, seed=0,
+         workers=None, batch_size=256, refresh=False):
+    """
+    Fit the two-breakpoint ITS model for every breakpoint pair and series.
+
+    Returns a long DataFrame with one row per (series, t1, t2, term):
+    SERIES_KEYS, 'break_1', 'break_2', 'term', 'coef', 'se', 'p_value',
+    'ci_low', 'ci_high', 'resample_p', 'r_squared', 'rss', 'aic', 'n_years',
+    'scan_p'. Everything up to 'aic' is for that pair taken on its own;
+    'scan_p' is the per-series p-value from scan_pvalue() and is the one to
+    use for "is there a break at all" after picking the best pair.
+    """
+    if method not in ("block", "permutation"):
+        raise ValueError(f"method must be 'block' or 'permutation', not {method!r}")
+
+    settings = dict(version=SCAN_VERSION, continent_map=continent_map or {}, method=method,
+                    n_resamples=n_resamples, block_length=block_length, ci=ci,
+                    min_cell=min_cell, min_segment=min_segment,
+                    start_year=start_year, seed=seed)
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    cache_path = CACHE_DIR / f"its_scan_{table_hash(agg, settings)}.csv"
+    if cache_path.exists() and not refresh:
+        print(f"✅ Loaded cached scan: {cache_path.name}")
+        return pd.read_csv(cache_path)
+
+    keys, years, Y = build_series(agg, continent_map, min_cell, start_year)
+    pairs = candidate_pairs(years, min_segment)
+    if not pairs:
+        raise ValueError(f"Need at least {3 * min_segment} years for three "
+                         f"{min_segment}-year segments, got {len(years)}")
+    print(f"🔎 Scanning {len(pairs)} breakpoint pairs × {len(keys):,} series "
+          f"= {len(pairs) * len(keys):,} fits ({method}, {n_resamples} resamples each)")
+
+    opts = dict(method=method, n_resamples=n_resamples, block_length=block_length,
+                ci=ci, batch_size=batch_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(pairs) + 1)
+    fits = {}
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                             initializer=_init_worker, initargs=(Y, years, opts)) as pool:
+        futures = {pool.submit(fit_pair, pair, s): pair for pair, s in zip(pairs, seeds)}
+        for i, fut in enumerate(as_completed(futures), 1):
+            fits[futures[fut]] = fut.result()
+            if i % 10 == 0 or i == len(pairs):
+                print(f"   {i}/{len(pairs)} breakpoint pairs fitted")
+
+    names = ("coef", "se", "p_value", "ci_low", "ci_high", "resample_p")
+    results = pd.concat([_long_frame(keys, t1, t2, fits[(t1, t2)], names) for t1, t2 in pairs],
+                        ignore_index=True)
+    results["n_years"] = len(years)
+
+    print(f"🔎 Repeating the breakpoint search in {n_resamples} permutations per series...")
+    scan_p = scan_pvalue(Y, years, pairs, n_resamples, seeds[-1], batch_size)
+    results["scan_p"] = np.tile(np.repeat(scan_p, len(TERMS)), len(pairs))
+
+    results.to_csv(cache_path, index=False)
+    print(f"💾 Cached scan results: {cache_path}")
+    return results
+
+CONDITIONAL = ["p_value", "ci_low", "ci_high", "resample_p"]
+
+def best_breakpoints(results):
+    """
+    Keep, for each series, the breakpoint pair with the lowest AIC.
+
+    The per-pair p-values and intervals do not allow for the pair having been
+    picked as the best of many, so they are renamed with a '_given_pair'
+    suffix; 'scan_p' is the selection-adjusted test for any break at all.
+    """
+    per_fit = results.drop_duplicates(SERIES_KEYS + ["break_1", "break_2"])
+    best = per_fit.loc[per_fit.groupby(SERIES_KEYS)["aic"].idxmin(),
+                       SERIES_KEYS + ["break_1", "break_2"]]
+    best = results.merge(best, on=SERIES_KEYS + ["break_1", "break_2"])
+    return best.rename(columns={c: f"{c}_given_pair" for c in CONDITIONAL})
+
+if __name__ == "__main__":
+    with open(CONF_PATH) as f:
+        CONF = json.load(f)
+    if not CONF.get("continent_map"):
+        raise SystemExit(f"❌ No continent_map in {CONF_PATH}; without it only "
+                         "'All' continent series can be built.")
+    start = CONF.get("time_windows", {}).get("start_month")
+    agg = pd.read_csv(AGG_CSV)
+    results = scan(
+        agg,
+        continent_map=CONF["continent_map"],
+        method="permutation" if "--permutation" in sys.argv else "block",
+        min_cell=CONF.get("ethics", {}).get("min_cell", 20),
+        start_year=int(start[:4]) if start else None,
+        refresh="--refresh" in sys.argv,
+    )
+    best = best_breakpoints(results)
+    out_path = STATS_DIR / "its_best_breakpoints.csv"
+    best.to_csv(out_path, index=False)
+    print(f"💾 Wrote {out_path} ({best[SERIES_KEYS].drop_duplicates().shape[0]:,} series)")